@@ -11,6 +11,12 @@ async def init_db():
             full_name TEXT,
             username TEXT)
         """)
+        await db.execute("""
+        CREATE TABLE IF NOT EXISTS stats_snapshot (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            data TEXT,
+            updated_at TEXT)
+        """)
         await db.commit()
 
 async def add_user(user_id: int, full_name: str, username: str):
@@ -41,4 +47,20 @@ async def get_all_user_ids():
     async with aiosqlite.connect('users.db') as db:
         cursor = await db.execute("SELECT user_id FROM users")
         rows = await cursor.fetchall()
-        return [row[0] for row in rows]
\ No newline at end of file
+        return [row[0] for row in rows]
+
+async def save_stats_snapshot(data: str):
+    """Збереження знімка статистики продажів"""
+    async with aiosqlite.connect(DB_PATH) as db:
+        await db.execute("""
+        INSERT OR REPLACE INTO stats_snapshot (id, data, updated_at)
+        VALUES (1, ?, datetime('now'))
+        """, (data,))
+        await db.commit()
+
+async def load_stats_snapshot():
+    """Отримання останнього знімка статистики продажів"""
+    async with aiosqlite.connect(DB_PATH) as db:
+        cursor = await db.execute("SELECT data FROM stats_snapshot WHERE id = 1")
+        row = await cursor.fetchone()
+        return row[0] if row else None
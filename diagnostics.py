@@ -0,0 +1,148 @@
+import os
+import sys
+import math
+import time
+import asyncio
+import logging
+import builtins
+import threading
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict
+
+logger = logging.getLogger(__name__)
+
+_original_import = builtins.__import__
+_import_stack = []
+_import_times: Dict[str, tuple] = {}
+
+MAX_PROFILE_SECONDS = 60
+
+
+def enabled() -> bool:
+    """Діагностика вмикається змінною DIAGNOSTICS=1 у .env"""
+    return os.getenv('DIAGNOSTICS', '').lower() in ('1', 'true', 'yes')
+
+
+def _timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+    if level or name in sys.modules:
+        return _original_import(name, globals, locals, fromlist, level)
+
+    start = time.perf_counter()
+    _import_stack.append(0.0)
+    try:
+        return _original_import(name, globals, locals, fromlist, level)
+    finally:
+        elapsed = time.perf_counter() - start
+        nested = _import_stack.pop()
+        if _import_stack:
+            _import_stack[-1] += elapsed
+        _import_times[name] = (elapsed, elapsed - nested)
+
+
+def start_import_profile():
+    """Починає вимірювання часу імпортів (лише якщо діагностику ввімкнено)"""
+    if enabled():
+        builtins.__import__ = _timed_import
+
+
+def stop_import_profile():
+    builtins.__import__ = _original_import
+
+
+def import_profile_report(limit: int = 15) -> str:
+    """Найповільніші імпорти: загальний час і власний час без вкладених імпортів"""
+    if not _import_times:
+        return "Профіль імпортів відсутній"
+    top = sorted(_import_times.items(), key=lambda item: item[1][0], reverse=True)[:limit]
+    lines = ["Профіль імпортів (загальний / власний час, мс):"]
+    lines += [f"{name}: {total * 1000:.1f} / {own * 1000:.1f}" for name, (total, own) in top]
+    return "\n".join(lines)
+
+
+class HandlerContextMiddleware:
+    """Називає задачу за поточним обробником і станом FSM, тож попередження
+    asyncio "Executing <Task name=...> took ..." показують, хто блокував loop.
+
+    Не наслідує aiogram.BaseMiddleware, щоб модуль не імпортував aiogram
+    раніше за профіль імпортів.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]],
+        event: Any,
+        data: Dict[str, Any]
+    ) -> Any:
+        handler_object = data.get("handler")
+        name = handler_object.callback.__name__ if handler_object else "?"
+        update = data.get("event_update")
+        label = f"{name}:{data.get('raw_state')}#{update.update_id if update else '?'}"
+
+        task = asyncio.current_task()
+        original = task.get_name()
+        task.set_name(label)
+        try:
+            return await handler(event, data)
+        finally:
+            # Ім'я повертається вже після поточного кроку задачі, інакше
+            # блокуючий код після останнього await залишився б без підпису
+            asyncio.get_running_loop().call_soon(_restore_task_name, task, label, original)
+
+
+def _restore_task_name(task: asyncio.Task, label: str, original: str):
+    if task.get_name() == label:
+        task.set_name(original)
+
+
+def setup(dp):
+    """Реєструє middleware, якщо діагностику ввімкнено"""
+    if not enabled():
+        return
+    middleware = HandlerContextMiddleware()
+    dp.message.middleware(middleware)
+    dp.callback_query.middleware(middleware)
+
+
+def watch_loop(loop: asyncio.AbstractEventLoop):
+    """Вмикає debug-режим asyncio зі звітами про повільні виклики"""
+    if not enabled():
+        return
+    loop.set_debug(True)
+    loop.slow_callback_duration = float(os.getenv('DIAGNOSTICS_SLOW_CALLBACK', 0.1))
+    logger.info(import_profile_report())
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _sample(thread_id: int, seconds: float, interval: float) -> Counter:
+    stacks = Counter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        frame = sys._current_frames().get(thread_id)
+        stack = []
+        while frame is not None:
+            stack.append(_frame_label(frame))
+            frame = frame.f_back
+        if stack:
+            stacks[";".join(reversed(stack))] += 1
+        time.sleep(interval)
+    return stacks
+
+
+def profile_duration(seconds: float) -> float:
+    """Тривалість профілювання в межах 1..MAX_PROFILE_SECONDS"""
+    if not math.isfinite(seconds) or seconds <= 0:
+        raise ValueError("Тривалість має бути додатним числом")
+    return min(max(seconds, 1), MAX_PROFILE_SECONDS)
+
+
+async def capture_profile(seconds: float, interval: float = 0.005) -> bytes:
+    """Семплює стек потоку event loop і повертає профіль у форматі folded stacks
+    (flamegraph.pl, speedscope). Порожній результат означає, що семплів немає."""
+    seconds = profile_duration(seconds)
+    thread_id = threading.get_ident()
+    stacks = await asyncio.to_thread(_sample, thread_id, seconds, interval)
+    return "\n".join(f"{stack} {count}" for stack, count in stacks.most_common()).encode()
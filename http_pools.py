@@ -0,0 +1,171 @@
+import os
+import ssl
+import logging
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import certifi
+from aiohttp import ClientSession, TCPConnector, TraceConfig
+from aiohttp.hdrs import USER_AGENT
+from aiohttp.http import SERVER_SOFTWARE
+from aiogram import __version__ as aiogram_version
+from aiogram.client.session.aiohttp import AiohttpSession
+import gspread
+from gspread.utils import convert_credentials
+from google.auth.transport.requests import AuthorizedSession, Request
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+_bot_session = None
+_sheets_adapter = None
+_sheets_pool_size = None
+_sheets_credentials = None
+_token_task = None
+
+
+class PooledAiohttpSession(AiohttpSession):
+    """Сесія Bot API з власним TCPConnector і лічильниками використання пулу.
+
+    TLS-контекст (certifi) і User-Agent такі ж, як у AiohttpSession.
+    Проксі не підтримується: бот працює з Bot API напряму.
+    """
+
+    def __init__(self, limit: int, keepalive_timeout: float, ttl_dns_cache: int, timeout: float):
+        super().__init__(timeout=timeout)
+        self.limit = limit
+        self.keepalive_timeout = keepalive_timeout
+        self.ttl_dns_cache = ttl_dns_cache
+        self.client_session = None
+        self.stats = {"in_use": 0, "queued": 0, "created": 0, "reused": 0}
+
+        self.trace_config = TraceConfig()
+        self.trace_config.on_request_start.append(self._on_request_start)
+        self.trace_config.on_request_end.append(self._on_request_done)
+        self.trace_config.on_request_exception.append(self._on_request_done)
+        self.trace_config.on_connection_queued_start.append(self._on_queued_start)
+        self.trace_config.on_connection_queued_end.append(self._on_queued_end)
+        self.trace_config.on_connection_create_end.append(self._on_connection_created)
+        self.trace_config.on_connection_reuseconn.append(self._on_connection_reused)
+
+    async def create_session(self) -> ClientSession:
+        if self.client_session is None or self.client_session.closed:
+            connector = TCPConnector(
+                limit=self.limit,
+                keepalive_timeout=self.keepalive_timeout,
+                use_dns_cache=True,
+                ttl_dns_cache=self.ttl_dns_cache,
+                ssl=ssl.create_default_context(cafile=certifi.where()),
+            )
+            self.client_session = ClientSession(
+                connector=connector,
+                headers={USER_AGENT: f"{SERVER_SOFTWARE} aiogram/{aiogram_version}"},
+                trace_configs=[self.trace_config],
+            )
+        return self.client_session
+
+    async def close(self):
+        if self.client_session is not None and not self.client_session.closed:
+            await self.client_session.close()
+        await super().close()
+
+    async def _on_request_start(self, session, context, params):
+        self.stats["in_use"] += 1
+
+    async def _on_request_done(self, session, context, params):
+        self.stats["in_use"] -= 1
+
+    async def _on_queued_start(self, session, context, params):
+        self.stats["queued"] += 1
+
+    async def _on_queued_end(self, session, context, params):
+        self.stats["queued"] -= 1
+
+    async def _on_connection_created(self, session, context, params):
+        self.stats["created"] += 1
+
+    async def _on_connection_reused(self, session, context, params):
+        self.stats["reused"] += 1
+
+
+def create_bot_session() -> AiohttpSession:
+    """Створює спільну сесію для Bot API (налаштування з .env)"""
+    global _bot_session
+    _bot_session = PooledAiohttpSession(
+        limit=int(os.getenv('BOT_POOL_LIMIT', 100)),
+        keepalive_timeout=float(os.getenv('BOT_KEEPALIVE_TIMEOUT', 60)),
+        ttl_dns_cache=int(os.getenv('BOT_DNS_CACHE_TTL', 3600)),
+        timeout=float(os.getenv('BOT_REQUEST_TIMEOUT', 30)),
+    )
+    return _bot_session
+
+
+def create_gspread_client(creds) -> gspread.Client:
+    """Авторизує gspread через спільну сесію requests з пулом з'єднань (налаштування з .env)"""
+    global _sheets_adapter, _sheets_credentials, _sheets_pool_size
+    pool_size = int(os.getenv('SHEETS_POOL_SIZE', 10))
+    _sheets_pool_size = pool_size
+
+    credentials = convert_credentials(creds)
+    _sheets_credentials = credentials
+    session = AuthorizedSession(credentials)
+    _sheets_adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", _sheets_adapter)
+
+    client = gspread.Client(auth=credentials, session=session)
+    client.set_timeout(float(os.getenv('SHEETS_REQUEST_TIMEOUT', 30)))
+    return client
+
+
+async def keep_token_fresh():
+    """Оновлює OAuth-токен заздалегідь, щоб оновлення не припадало на запит користувача"""
+    margin = timedelta(seconds=int(os.getenv('SHEETS_TOKEN_REFRESH_MARGIN', 300)))
+    request = Request()
+    while True:
+        try:
+            expiry = _sheets_credentials.expiry
+            if expiry is not None:
+                # expiry у google-auth зберігається як naive UTC
+                refresh_at = expiry - margin
+                delay = (refresh_at - datetime.now(timezone.utc).replace(tzinfo=None)).total_seconds()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            await asyncio.to_thread(_sheets_credentials.refresh, request)
+            logger.info("OAuth-токен Google оновлено")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Не вдалося оновити OAuth-токен Google: {e}")
+            await asyncio.sleep(30)
+
+
+def start_token_refresh():
+    """Запускає фонове оновлення OAuth-токена"""
+    global _token_task
+    if _token_task is None or _token_task.done():
+        _token_task = asyncio.create_task(keep_token_fresh())
+
+
+def pool_usage() -> dict:
+    """Поточне використання пулів з'єднань для моніторингу"""
+    usage = {}
+
+    if _bot_session is not None:
+        usage["telegram"] = {"limit": _bot_session.limit, **_bot_session.stats}
+
+    if _sheets_adapter is not None:
+        in_use = 0
+        created = 0
+        pools = _sheets_adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None or pool.pool is None:
+                continue
+            in_use += pool.pool.maxsize - pool.pool.qsize()
+            created += pool.num_connections
+        usage["sheets"] = {
+            "limit": _sheets_pool_size,
+            "in_use": in_use,
+            "created": created,
+        }
+    return usage
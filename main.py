@@ -3,21 +3,29 @@ import logging
 import json
 from dotenv import load_dotenv
 from datetime import datetime
+
+import diagnostics
+
+load_dotenv()
+diagnostics.start_import_profile()
+
 from aiogram import Bot, Dispatcher, types, F
-from aiogram.filters import Command
+from aiogram.filters import Command, CommandObject
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.utils.keyboard import InlineKeyboardBuilder, ReplyKeyboardBuilder
-from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup, BotCommandScopeChat
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup, BotCommandScopeChat, BufferedInputFile
 from aiogram.exceptions import TelegramForbiddenError, TelegramRetryAfter
-import gspread
 from oauth2client.service_account import ServiceAccountCredentials
 from gspread.exceptions import WorksheetNotFound
 import asyncio
 
-from db import init_db, add_user, get_all_user_ids
+from db import init_db, add_user, get_all_user_ids, save_stats_snapshot, load_stats_snapshot
+from stats import SalesStats, order_from_row, STATUS_APPROVED, STATUS_REJECTED
+from http_pools import create_bot_session, create_gspread_client, start_token_refresh, pool_usage
+from scheduler import UpdateScheduler
 
-load_dotenv()
+diagnostics.stop_import_profile()
 
 # Налаштування логування
 logging.basicConfig(
@@ -48,7 +56,7 @@ class AdminStates(StatesGroup):
 try:
     scope = ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']
     creds = ServiceAccountCredentials.from_json_keyfile_name('google-credentials.json', scope)
-    client = gspread.authorize(creds)
+    client = create_gspread_client(creds)
     spreadsheet = client.open("Продаж квитків")
     
     try:
@@ -85,9 +93,26 @@ if not TOKEN or not ADMIN_IDS:
     raise ValueError("Будь ласка, перевірте налаштування .env файлу - TELEGRAM_BOT_TOKEN та TELEGRAM_ADMIN_ID мають бути встановлені")
 
 # Ініціалізація бота та диспетчера
-bot = Bot(token=TOKEN)
+bot = Bot(token=TOKEN, session=create_bot_session())
 dp = Dispatcher()
 
+# Планувальник апдейтів: обмежений пул воркерів і послідовна обробка в межах чату
+scheduler = UpdateScheduler(
+    dp,
+    workers=int(os.getenv('SCHEDULER_WORKERS', 8)),
+    max_pending=int(os.getenv('SCHEDULER_MAX_PENDING', 1000)),
+    max_chat_queue=int(os.getenv('SCHEDULER_MAX_CHAT_QUEUE', 10)),
+    callback_ttl=float(os.getenv('SCHEDULER_CALLBACK_TTL', 30))
+)
+dp.update.outer_middleware(scheduler)
+diagnostics.setup(dp)
+
+# Агрегати продажів (див. stats.py) та блокування для запису знімка
+sales_stats = SalesStats()
+stats_lock = asyncio.Lock()
+# Читання та зміна статусу заявки мають бути атомарними для статистики
+orders_lock = asyncio.Lock()
+
 # Інформація про подію
 EVENT_INFO_TEXT = """
 🎟️ <b>Назва події: Останній оман</b>  
@@ -105,7 +130,7 @@ EVENT_INFO_TEXT = """
 
 async def update_data_for_buttons(selected_date=None):
     """Отримує унікальні дати або слоти для конкретної дати"""
-    records = tikets_sheet.get_all_records()
+    records = await asyncio.to_thread(tikets_sheet.get_all_records)
     
     if not selected_date:
         # Повертаємо унікальні дати (без дублікатів)
@@ -114,10 +139,42 @@ async def update_data_for_buttons(selected_date=None):
     # Повертаємо всі записи для обраної дати
     return [r for r in records if r.get("Дата") == selected_date]
 
+async def save_sales_stats():
+    """Зберігає актуальний знімок статистики в SQLite"""
+    async with stats_lock:
+        try:
+            await save_stats_snapshot(json.dumps(sales_stats.to_dict(), ensure_ascii=False))
+        except Exception as e:
+            logger.error(f"Не вдалося зберегти статистику: {e}")
+
+async def rebuild_sales_stats():
+    """Перераховує статистику з таблиці (враховує і ручні правки аркуша)"""
+    global sales_stats
+    sales_stats = SalesStats.from_records(await asyncio.to_thread(sheet.get_all_records))
+    await save_sales_stats()
+    logger.info("Статистику продажів перераховано з таблиці")
+
+async def load_sales_stats():
+    """Перераховує статистику при запуску, а якщо таблиця недоступна - відновлює зі знімка"""
+    global sales_stats
+    try:
+        await rebuild_sales_stats()
+        return
+    except Exception as e:
+        logger.error(f"Не вдалося перерахувати статистику з таблиці: {e}")
+
+    snapshot = await load_stats_snapshot()
+    if snapshot:
+        sales_stats = SalesStats.from_dict(json.loads(snapshot))
+        logger.warning("Статистику продажів відновлено зі знімка, вона може бути неповною")
+
 async def set_bot_commands(bot: Bot, admin_ids: list[int]) -> None:
     admin_commands = [
         types.BotCommand(command="admin", description="Адмін-панель"),
-        types.BotCommand(command="broadcast", description="Розсилка повідомлень")
+        types.BotCommand(command="broadcast", description="Розсилка повідомлень"),
+        types.BotCommand(command="stats", description="Статистика продажів"),
+        types.BotCommand(command="pools", description="Використання пулів з'єднань"),
+        types.BotCommand(command="profile", description="Профіль продуктивності")
     ]
 
     user_commands = [
@@ -386,7 +443,9 @@ async def process_pickup_time(callback: types.CallbackQuery, state: FSMContext):
         "New"
     ]
     
-    sheet.append_row(row)
+    await asyncio.to_thread(sheet.append_row, row)
+    sales_stats.add_order(order_from_row(row))
+    asyncio.create_task(save_sales_stats())
     
     await callback.message.edit_text(
         text=f"<b>Дякуємо за покупку!</b>\nВаші дані збережено. Чекайте на підтвердження: \n\n"
@@ -406,7 +465,7 @@ async def process_feedback(callback: types.CallbackQuery, state: FSMContext):
 
 @dp.message(Form.feedback)
 async def process_feedback_message(message: types.Message, state: FSMContext):
-    feedback_sheet.append_row([
+    await asyncio.to_thread(feedback_sheet.append_row, [
         datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
         message.from_user.username,
         message.text,
@@ -490,7 +549,7 @@ async def cmd_reply(message: types.Message):
         username = parts[1].replace('@', '').strip()
         reply_text = parts[2]
         
-        feedback_records = feedback_sheet.get_all_records()
+        feedback_records = await asyncio.to_thread(feedback_sheet.get_all_records)
         
         user_feedback = None
         for record in reversed(feedback_records):
@@ -508,8 +567,8 @@ async def cmd_reply(message: types.Message):
             return
             
         row_num = feedback_records.index(user_feedback) + 2
-        feedback_sheet.update_cell(row_num, 4, "Відповідь надіслано")
-        feedback_sheet.update_cell(row_num, 5, reply_text)
+        await asyncio.to_thread(feedback_sheet.update_cell, row_num, 4, "Відповідь надіслано")
+        await asyncio.to_thread(feedback_sheet.update_cell, row_num, 5, reply_text)
         
         try:
             await bot.send_message(
@@ -519,12 +578,70 @@ async def cmd_reply(message: types.Message):
             )
             await message.answer(f"Повідомлення відправлено @{username}")
         except Exception as e:
-            feedback_sheet.update_cell(row_num, 4, f"Помилка: {str(e)[:50]}")
+            await asyncio.to_thread(feedback_sheet.update_cell, row_num, 4, f"Помилка: {str(e)[:50]}")
             await message.answer(f"Помилка відправки: {e}")
             
     except Exception as e:
         await message.answer(f"Помилка: {e}\nВикористовуйте: /reply @username текст")
 
+@dp.message(Command("stats"))
+async def cmd_stats(message: types.Message, command: CommandObject):
+    if message.from_user.id not in ADMIN_IDS:
+        return
+
+    if (command.args or "").strip() == "refresh":
+        try:
+            await rebuild_sales_stats()
+        except Exception as e:
+            await message.answer(f"Не вдалося перерахувати статистику: {e}")
+            return
+
+    await message.answer(sales_stats.format(), parse_mode="HTML")
+
+@dp.message(Command("pools"))
+async def cmd_pools(message: types.Message):
+    if message.from_user.id not in ADMIN_IDS:
+        return
+
+    lines = ["🔌 <b>Пули з'єднань:</b>"]
+    for name, usage in {**pool_usage(), "scheduler": scheduler.usage()}.items():
+        lines.append(f"• {name}: " + ", ".join(f"{key}={value}" for key, value in usage.items()))
+    await message.answer("\n".join(lines), parse_mode="HTML")
+
+@dp.message(Command("profile"))
+async def cmd_profile(message: types.Message, command: CommandObject):
+    if message.from_user.id not in ADMIN_IDS:
+        return
+
+    if not diagnostics.enabled():
+        await message.answer("Діагностику вимкнено. Встановіть DIAGNOSTICS=1 у .env")
+        return
+
+    args = (command.args or "").strip()
+    if args == "imports":
+        await message.answer(diagnostics.import_profile_report())
+        return
+
+    try:
+        seconds = diagnostics.profile_duration(float(args) if args else 10)
+    except ValueError:
+        await message.answer(
+            f"Використовуйте: /profile [секунд від 1 до {diagnostics.MAX_PROFILE_SECONDS}] або /profile imports"
+        )
+        return
+
+    await message.answer(f"⏱ Збираю профіль ({seconds:g} сек.)...")
+    data = await diagnostics.capture_profile(seconds)
+    if not data:
+        await message.answer("Не вдалося зібрати жодного семпла")
+        return
+
+    filename = f"profile-{datetime.now().strftime('%Y%m%d-%H%M%S')}.folded"
+    await message.answer_document(
+        BufferedInputFile(data, filename=filename),
+        caption="Профіль у форматі folded stacks (flamegraph.pl, speedscope)"
+    )
+
 @dp.message(Command("admin"))
 async def cmd_admin(message: types.Message, state: FSMContext):
     if message.from_user.id not in ADMIN_IDS:
@@ -543,7 +660,7 @@ async def cmd_admin(message: types.Message, state: FSMContext):
 
 @dp.message(F.text == "📋 Переглянути заявки", AdminStates.admin_menu)
 async def process_view_orders(message: types.Message, state: FSMContext):
-    orders = sheet.get_all_records()
+    orders = await asyncio.to_thread(sheet.get_all_records)
     
     unprocessed_order = None
     for order in orders:
@@ -604,9 +721,14 @@ async def process_view_orders(message: types.Message, state: FSMContext):
 async def process_approve(callback: types.CallbackQuery, state: FSMContext):
     row_num = int(callback.data.split("_")[1])
     
-    sheet.update_cell(row_num, 11, "Підтверджено")
+    async with orders_lock:
+        order_data = await asyncio.to_thread(sheet.row_values, row_num)
+        old_status = order_data[10] if len(order_data) > 10 else ""
+        
+        await asyncio.to_thread(sheet.update_cell, row_num, 11, STATUS_APPROVED)
+        sales_stats.change_status(order_from_row(order_data), old_status, STATUS_APPROVED)
+    asyncio.create_task(save_sales_stats())
     
-    order_data = sheet.row_values(row_num)
     if len(order_data) > 9:
         try:
             await bot.send_message(
@@ -624,9 +746,14 @@ async def process_approve(callback: types.CallbackQuery, state: FSMContext):
 async def process_reject(callback: types.CallbackQuery, state: FSMContext):
     row_num = int(callback.data.split("_")[1])
     
-    sheet.update_cell(row_num, 11, "Відхилено")
+    async with orders_lock:
+        order_data = await asyncio.to_thread(sheet.row_values, row_num)
+        old_status = order_data[10] if len(order_data) > 10 else ""
+        
+        await asyncio.to_thread(sheet.update_cell, row_num, 11, STATUS_REJECTED)
+        sales_stats.change_status(order_from_row(order_data), old_status, STATUS_REJECTED)
+    asyncio.create_task(save_sales_stats())
     
-    order_data = sheet.row_values(row_num)
     if len(order_data) > 9:
         try:
             await bot.send_message(
@@ -647,7 +774,7 @@ async def process_stop(callback: types.CallbackQuery, state: FSMContext):
     await callback.answer()
 
 async def show_next_order(message: types.Message, state: FSMContext):
-    orders = sheet.get_all_records()
+    orders = await asyncio.to_thread(sheet.get_all_records)
     
     unprocessed_order = None
     for order in orders:
@@ -685,13 +812,23 @@ async def show_next_order(message: types.Message, state: FSMContext):
     await state.update_data(current_row=row_num)
 
 async def on_startup(bot: Bot):
+    diagnostics.watch_loop(asyncio.get_running_loop())
     await init_db()
+    scheduler.start()
+    start_token_refresh()
+    await load_sales_stats()
     await set_bot_commands(bot, ADMIN_IDS)
     await update_data_for_buttons()
 
+async def on_shutdown(bot: Bot):
+    await scheduler.stop(timeout=float(os.getenv('SCHEDULER_DRAIN_TIMEOUT', 30)))
+    await save_sales_stats()
+
 async def main():
     dp.startup.register(on_startup)
-    await dp.start_polling(bot)
+    dp.shutdown.register(on_shutdown)
+    # Апдейти ставить у черги планувальник, тому окремі задачі не потрібні
+    await dp.start_polling(bot, handle_as_tasks=False)
 
 if __name__ == '__main__':
     asyncio.run(main())
\ No newline at end of file
@@ -0,0 +1,187 @@
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware, Dispatcher
+from aiogram.dispatcher.event.bases import UNHANDLED, CancelHandler, SkipHandler
+from aiogram.types import ErrorEvent, Update
+
+logger = logging.getLogger(__name__)
+
+
+class UpdateScheduler(BaseMiddleware):
+    """Планувальник апдейтів замість задачі на кожен апдейт.
+
+    Апдейти розкладаються по чергах чатів і обробляються фіксованим пулом
+    воркерів: у межах одного чату - строго послідовно, між чатами - по черзі.
+    Якщо загальна кількість апдейтів досягла max_pending, полінг чекає
+    (backpressure). Відкидаються лише callback-запити: застарілі та найстаріші
+    в переповненій черзі чату. Повідомлення не відкидаються ніколи.
+
+    Помилки обробників передаються в @dp.errors() так само, як це робить
+    ErrorsMiddleware, а результат і тривалість обробки логуються тут, бо
+    диспетчер бачить лише постановку в чергу.
+    """
+
+    def __init__(self, dispatcher: Dispatcher, workers: int = 8, max_pending: int = 1000,
+                 max_chat_queue: int = 10, callback_ttl: float = 30.0):
+        if max_chat_queue < 2:
+            raise ValueError("max_chat_queue має бути не менше 2")
+        self.dispatcher = dispatcher
+        self.workers = workers
+        self.max_chat_queue = max_chat_queue
+        self.callback_ttl = callback_ttl
+        self.dropped = 0
+        self.running = 0
+
+        self._capacity = asyncio.Semaphore(max_pending)
+        self._queues: Dict[int, deque] = {}
+        self._scheduled = set()
+        self._ready = asyncio.Queue()
+        self._tasks = []
+
+    async def __call__(
+        self,
+        handler: Callable[[Update, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any]
+    ) -> Any:
+        chat = data.get("event_chat")
+        user = data.get("event_from_user")
+        key = chat.id if chat else (user.id if user else 0)
+
+        queue = self._queues.get(key)
+        if queue is not None and len(queue) >= self.max_chat_queue:
+            if not self._shed_oldest_callback(queue) and event.callback_query:
+                self._drop(event, "переповнена черга чату")
+                return None
+
+        await self._capacity.acquire()
+
+        queue = self._queues.setdefault(key, deque())
+        queue.append((handler, event, data, time.monotonic()))
+        if key not in self._scheduled:
+            self._scheduled.add(key)
+            self._ready.put_nowait(key)
+        return None
+
+    def start(self):
+        """Запускає пул воркерів"""
+        logging.getLogger("aiogram.event").addFilter(_queued_update_log_filter)
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self, timeout: float = 30.0):
+        """Дочікується обробки апдейтів у чергах (не довше timeout) і зупиняє воркери.
+
+        Полінг уже підтвердив ці апдейти в Telegram, тож без очікування вони
+        були б втрачені.
+        """
+        deadline = time.monotonic() + timeout
+        while self._scheduled and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        if self._scheduled:
+            pending = sum(len(queue) for queue in self._queues.values())
+            logger.warning(f"Планувальник зупинено, не оброблено апдейтів: {pending}")
+
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def usage(self) -> dict:
+        return {
+            "workers": self.workers,
+            "chats": len(self._queues),
+            "queued": sum(len(queue) for queue in self._queues.values()),
+            "running": self.running,
+            "dropped": self.dropped,
+        }
+
+    async def _worker(self):
+        while True:
+            key = await self._ready.get()
+            queue = self._queues.get(key)
+            try:
+                # Черга могла спорожніти через відкидання callback-запитів
+                if not queue:
+                    continue
+                handler, event, data, enqueued_at = queue.popleft()
+                self.running += 1
+                try:
+                    await self._process(handler, event, data, enqueued_at)
+                except Exception:
+                    logger.exception(f"Помилка обробки апдейта {event.update_id}")
+                finally:
+                    self.running -= 1
+                    self._capacity.release()
+            finally:
+                # Чат повертається в кінець черги, щоб інші чати не чекали
+                if queue:
+                    self._ready.put_nowait(key)
+                else:
+                    self._queues.pop(key, None)
+                    self._scheduled.discard(key)
+
+    async def _process(self, handler, event: Update, data: Dict[str, Any], enqueued_at: float):
+        if event.callback_query and time.monotonic() - enqueued_at > self.callback_ttl:
+            self._drop(event, "застарілий callback")
+            return
+
+        # FSMContextMiddleware прочитав стан ще при постановці в чергу, а
+        # попередні апдейти цього чату могли його змінити
+        state = data.get("state")
+        if state is not None:
+            data["raw_state"] = await state.get_state()
+
+        started = time.monotonic()
+        try:
+            response = await handler(event, data)
+        except (SkipHandler, CancelHandler):
+            response = UNHANDLED
+        except Exception as e:
+            response = await self.dispatcher.propagate_event(
+                update_type="error",
+                event=ErrorEvent(update=event, exception=e),
+                **data
+            )
+            if response is UNHANDLED:
+                raise
+        finally:
+            duration = (time.monotonic() - started) * 1000
+            waited = (started - enqueued_at) * 1000
+
+        logger.info(
+            f"Апдейт {event.update_id} {'оброблено' if response is not UNHANDLED else 'не оброблено'}. "
+            f"Тривалість {duration:.0f} мс, у черзі {waited:.0f} мс"
+        )
+
+    def _shed_oldest_callback(self, queue: deque) -> bool:
+        for job in queue:
+            if job[1].callback_query:
+                queue.remove(job)
+                self._capacity.release()
+                self._drop(job[1], "переповнена черга чату")
+                return True
+        return False
+
+    def _drop(self, event: Update, reason: str):
+        self.dropped += 1
+        logger.warning(f"Апдейт {event.update_id} відкинуто: {reason}")
+        if event.callback_query:
+            asyncio.create_task(self._answer_dropped(event))
+
+    @staticmethod
+    async def _answer_dropped(event: Update):
+        try:
+            await event.callback_query.answer("Забагато запитів, спробуйте ще раз")
+        except Exception as e:
+            logger.debug(f"Не вдалося відповісти на callback: {e}")
+
+
+def _queued_update_log_filter(record: logging.LogRecord) -> bool:
+    """Прибирає рядок диспетчера "Update id=N is handled": з планувальником він
+    означає лише постановку в чергу, справжній результат логує UpdateScheduler"""
+    return not (isinstance(record.msg, str) and record.msg.startswith("Update id="))
@@ -0,0 +1,131 @@
+from collections import Counter
+from html import escape
+
+STATUS_NEW = "New"
+STATUS_APPROVED = "Підтверджено"
+STATUS_REJECTED = "Відхилено"
+
+# Розрізи, за якими рахуємо кількість квитків
+DIMENSIONS = ("date", "location", "time", "institute")
+
+
+def order_from_row(row: list) -> dict:
+    """Поля заявки з рядка аркуша "Продажі" (порядок колонок як у таблиці)"""
+    row = list(row) + [""] * (11 - len(row))
+    return {
+        "institute": row[2],
+        "tickets": row[3],
+        "date": row[4],
+        "location": row[5],
+        "time": row[6],
+        "status": row[10] or STATUS_NEW,
+    }
+
+
+def order_from_record(record: dict) -> dict:
+    """Поля заявки із запису get_all_records()"""
+    return {
+        "institute": record.get("Інститут", ""),
+        "tickets": record.get("Кількість квитків", ""),
+        "date": record.get("Дата отримання", ""),
+        "location": record.get("Місце отримання", ""),
+        "time": record.get("Час отримання", ""),
+        "status": record.get("Статус", "") or STATUS_NEW,
+    }
+
+
+class SalesStats:
+    """Агрегати продажів, що оновлюються інкрементально при зміні заявок.
+
+    Відхилені заявки не враховуються в кількості квитків за розрізами,
+    але рахуються в кількості заявок за статусами.
+    """
+
+    def __init__(self):
+        self.by_status = Counter()
+        self.tickets = {dim: Counter() for dim in DIMENSIONS}
+        self.total_tickets = 0
+
+    def _apply(self, order: dict, sign: int):
+        try:
+            count = int(order.get("tickets") or 0)
+        except (TypeError, ValueError):
+            count = 0
+        self.total_tickets += sign * count
+        for dim in DIMENSIONS:
+            key = str(order.get(dim) or "—")
+            self.tickets[dim][key] += sign * count
+            if self.tickets[dim][key] <= 0:
+                del self.tickets[dim][key]
+
+    def add_order(self, order: dict):
+        """Нова заявка"""
+        status = order.get("status") or STATUS_NEW
+        self.by_status[status] += 1
+        if status != STATUS_REJECTED:
+            self._apply(order, 1)
+
+    def change_status(self, order: dict, old_status: str, new_status: str):
+        """Зміна статусу наявної заявки"""
+        old_status = old_status or STATUS_NEW
+        if old_status == new_status:
+            return
+
+        self.by_status[old_status] -= 1
+        if self.by_status[old_status] <= 0:
+            del self.by_status[old_status]
+        self.by_status[new_status] += 1
+
+        if new_status == STATUS_REJECTED:
+            self._apply(order, -1)
+        elif old_status == STATUS_REJECTED:
+            self._apply(order, 1)
+
+    @property
+    def pending(self) -> int:
+        return self.by_status.get(STATUS_NEW, 0)
+
+    @classmethod
+    def from_records(cls, records: list[dict]) -> "SalesStats":
+        """Повний перерахунок із записів аркуша (лише якщо немає знімка)"""
+        stats = cls()
+        for record in records:
+            stats.add_order(order_from_record(record))
+        return stats
+
+    def to_dict(self) -> dict:
+        return {
+            "by_status": dict(self.by_status),
+            "tickets": {dim: dict(counter) for dim, counter in self.tickets.items()},
+            "total_tickets": self.total_tickets,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "SalesStats":
+        stats = cls()
+        stats.by_status.update(data.get("by_status", {}))
+        for dim in DIMENSIONS:
+            stats.tickets[dim].update(data.get("tickets", {}).get(dim, {}))
+        stats.total_tickets = data.get("total_tickets", 0)
+        return stats
+
+    def format(self) -> str:
+        lines = [
+            "📊 <b>Статистика продажів:</b>",
+            f"• Усього квитків: {self.total_tickets}",
+            f"• Очікують підтвердження: {self.pending}",
+            "",
+            "<b>Заявки за статусами:</b>",
+        ]
+        lines += [f"• {escape(status)}: {count}" for status, count in sorted(self.by_status.items())]
+
+        titles = {
+            "date": "Квитки за датами",
+            "location": "Квитки за місцями",
+            "time": "Квитки за часом",
+            "institute": "Квитки за інститутами",
+        }
+        for dim in DIMENSIONS:
+            lines += ["", f"<b>{titles[dim]}:</b>"]
+            lines += [f"• {escape(key)}: {count}" for key, count in sorted(self.tickets[dim].items())]
+        return "\n".join(lines)